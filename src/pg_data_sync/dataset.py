@@ -1,21 +1,52 @@
+import asyncio
+import itertools
+import os
 import re
+import shutil
+import struct
+import threading
 import zipfile
+import zlib
 import time
-from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from uuid import UUID
+from types import ModuleType
+from uuid import UUID, uuid4
 from datetime import datetime, date
-from typing import Dict, List, Any
-from httpx import AsyncClient, BasicAuth
-import aiofiles
-import xmltodict
+from io import BytesIO
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Any
+from httpx import AsyncClient, BasicAuth, Limits
+from lxml import etree
+from stream_unzip import NotStreamUnzippable, stream_unzip
 from .models import DatasetConfig
 from .utils import get_env, delete_file_or_dir, get_file_size
 
+deflate: ModuleType | None
+
+try:
+    import deflate
+except ImportError:
+    deflate = None
+
 
 DOWNLOAD_API_BASE_URL = 'https://nedlasting.geonorge.no/api'
 METADATA_API_URL = 'https://kartkatalog.geonorge.no/api/getdata'
 DOWNLOAD_TIMEOUT = 1800
+LIBDEFLATE_MAX_SIZE = 64 * 1024 * 1024
+EXTRACT_MAX_WORKERS = 8
+COPY_BUFFER_SIZE = 1024 * 1024
+DOWNLOAD_WRITE_SIZE = 4 * 1024 * 1024
+EXTRACT_QUEUE_SIZE = 16
+HTTP_MAX_CONNECTIONS = 16
+ATOM_NAMESPACE = 'http://www.w3.org/2005/Atom'
+CRS_SCHEME = 'http://www.opengis.net/def/crs/'
+LOCAL_HEADER_SIZE = 30
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+_NATIONWIDE_RE = re.compile(r'^.*?landsdekkende$', re.IGNORECASE)
+_CODE_RE = re.compile(r'\d+')
+
+_client: AsyncClient | None = None
 
 
 async def place_order(config: DatasetConfig) -> str:
@@ -40,18 +71,36 @@ async def download_file(url: str, filename: str) -> None:
     file_path.parent.mkdir(parents=True, exist_ok=True)
 
     try:
-        async with AsyncClient(timeout=DOWNLOAD_TIMEOUT) as client:
-            async with client.stream('GET', url, auth=auth, follow_redirects=True) as response:
-                response.raise_for_status()
+        client = _get_client()
+
+        async with client.stream('GET', url, auth=auth, follow_redirects=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+
+            content_length = response.headers.get('Content-Length')
+            file_size = get_file_size(content_length)
+
+            print(f'Downloading file ({file_size:.2f} MB)...')
+
+            loop = asyncio.get_running_loop()
+            fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
 
-                content_length = response.headers.get('Content-Length')
-                file_size = get_file_size(content_length)
+            try:
+                chunks: List[bytes] = []
+                size = 0
 
-                print(f'Downloading file ({file_size:.2f} MB)...')
+                async for chunk in response.aiter_bytes(1024 * 1024):
+                    chunks.append(chunk)
+                    size += len(chunk)
 
-                async with aiofiles.open(filename, mode='wb') as file:
-                    async for chunk in response.aiter_bytes(1024 * 1024):
-                        await file.write(chunk)
+                    if size >= DOWNLOAD_WRITE_SIZE:
+                        await loop.run_in_executor(None, _write_chunks, fd, chunks)
+                        chunks = []
+                        size = 0
+
+                if chunks:
+                    await loop.run_in_executor(None, _write_chunks, fd, chunks)
+            finally:
+                os.close(fd)
 
         print(
             f'File downloaded from "{url}" in {round(time.time() - start, 2)} sec.')
@@ -59,15 +108,49 @@ async def download_file(url: str, filename: str) -> None:
         raise Exception(f'Error downloading file: {err}')
 
 
-def extract_archive(file_path: str, out_dir: str) -> str:
+async def download_and_extract(url: str, out_dir: str, verify_crc: bool = True) -> str:
+    try:
+        return await _stream_extract(url, out_dir)
+    except NotStreamUnzippable:
+        print('Archive cannot be extracted while downloading. Downloading it before extracting...')
+
+    return await download_then_extract(url, out_dir, verify_crc)
+
+
+async def download_then_extract(url: str, out_dir: str, verify_crc: bool = True) -> str:
+    file_path = str(Path(out_dir).joinpath(f'{uuid4()}.zip'))
+
+    await download_file(url, file_path)
+
+    return await asyncio.to_thread(extract_archive, file_path, out_dir, verify_crc)
+
+
+def extract_archive(file_path: str, out_dir: str, verify_crc: bool = True) -> str:
     start = time.time()
 
     try:
         with zipfile.ZipFile(file_path, 'r') as zip_ref:
-            zip_ref.extractall(out_dir)
+            infos = zip_ref.infolist()
 
-            print(
-                f'Archive "{file_path}" extracted in {round(time.time() - start, 2)} sec.')
+        for info in infos:
+            _get_target_path(out_dir, info.filename)
+
+        file_infos = [info for info in infos if not info.is_dir()]
+        workers = min(os.process_cpu_count() or 1, EXTRACT_MAX_WORKERS, len(file_infos))
+
+        if workers <= 1:
+            with zipfile.ZipFile(file_path, 'r') as zip_ref, open(file_path, 'rb') as file:
+                for info in infos:
+                    _extract_member(zip_ref, file, info, out_dir, verify_crc)
+        else:
+            for info in infos:
+                if info.is_dir():
+                    _get_target_path(out_dir, info.filename).mkdir(parents=True, exist_ok=True)
+
+            _extract_members_threaded(file_path, file_infos, out_dir, verify_crc, workers)
+
+        print(
+            f'Archive "{file_path}" extracted in {round(time.time() - start, 2)} sec.')
         return out_dir
     except Exception as err:
         raise Exception(f'Error extracting archive: {err}')
@@ -77,9 +160,11 @@ def extract_archive(file_path: str, out_dir: str) -> str:
 
 def get_resource_path(out_dir: str, glob: str | None) -> str:
     if not glob:
-        paths = list(Path(out_dir).glob('*'))
+        matches = Path(out_dir).glob('*')
     else:
-        paths = list(Path(out_dir).rglob(glob, case_sensitive=False))
+        matches = Path(out_dir).rglob(glob, case_sensitive=False)
+
+    paths = list(itertools.islice(matches, 2))
 
     if not len(paths) == 1:
         raise Exception(f'Could not find resource in "{out_dir}"')
@@ -87,16 +172,23 @@ def get_resource_path(out_dir: str, glob: str | None) -> str:
     return str(paths[0])
 
 
+async def close_client() -> None:
+    global _client
+
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
 async def get_dataset_update_date(metadata_id: UUID, area_code: str, area_type: str, epsg: str, format: str) -> date | None:
     feed_url = await _get_feed_url(metadata_id, format)
 
     if not feed_url:
         return None
 
-    xml_str = await _fetch_feed(feed_url)
-    doc = xmltodict.parse(xml_str)
+    feed = await _fetch_feed(feed_url)
 
-    update_date = _get_dataset_update_date(doc, area_code, area_type, epsg)
+    update_date = _get_dataset_update_date(feed, area_code, area_type, epsg)
 
     return update_date
 
@@ -113,71 +205,51 @@ async def fetch_order(config: DatasetConfig) -> Dict[str, Any]:
     auth = BasicAuth(get_env('API_USERNAME'), get_env('API_PASSWORD'))
  
     try:
-        async with AsyncClient() as client:
-            response = await client.post(url, headers=headers, auth=auth, json=request_body)
-            response.raise_for_status()
-            print('Download order placed')
+        client = _get_client()
+        response = await client.post(url, headers=headers, auth=auth, json=request_body)
+        response.raise_for_status()
+        print('Download order placed')
 
-            return response.json()
+        return response.json()
     except Exception as err:
         raise Exception(f'Error placing download order: {err}')
 
 
-def _get_dataset_update_date(doc: OrderedDict[str, Any], area_code: str, area_type: str, epsg: str) -> date | None:
-    nationwide_regex = re.compile(r'^.*?landsdekkende$', re.IGNORECASE)
-    code_regex = re.compile(r'^.*?(?P<code>\d+).*$')
-
-    feed: Dict = doc.get('feed', {})
-    entries: List[Dict[str, Any]] = feed.get('entry', [])
+def _get_dataset_update_date(feed: bytes, area_code: str, area_type: str, epsg: str) -> date | None:
+    entries = etree.iterparse(BytesIO(feed), events=(
+        'end',), tag=f'{{{ATOM_NAMESPACE}}}entry', resolve_entities=False)
     date_str: str = ''
 
-    for entry in entries:
-        categories: List[Dict[str, str]] = []
-        category_nodes = entry.get('category', [])
-
-        if isinstance(category_nodes, dict):
-            categories.append(category_nodes)
-        else:
-            categories = category_nodes
+    for _, entry in entries:
+        categories = entry.findall(f'{{{ATOM_NAMESPACE}}}category')
 
-        crs = next((cat.get('@term') for cat in categories if cat.get('@scheme')
-                    == 'http://www.opengis.net/def/crs/'), None)
+        crs = next((cat.get('term') for cat in categories if cat.get('scheme')
+                    == CRS_SCHEME), None)
 
-        if not crs:
+        if not crs or crs.split(':')[-1] != epsg:
+            entry.clear()
             continue
 
-        parts = crs.split(':')
-
-        if parts[-1] != epsg:
-            continue
-
-        title: str = entry.get('title', '')
+        title: str = entry.findtext(f'{{{ATOM_NAMESPACE}}}title', '')
 
         if area_type == 'landsdekkende':
-            match = nationwide_regex.search(title)
+            match = _NATIONWIDE_RE.search(title)
 
             if match:
-                date_str = entry.get('updated', '')
+                date_str = entry.findtext(f'{{{ATOM_NAMESPACE}}}updated', '')
                 break
         else:
-            hit = any(cat.get('@term', '').lower()
+            hit = any(cat.get('term', '').lower()
                       == area_type for cat in categories)
 
-            if not hit:
-                continue
-
-            match = code_regex.search(title)
+            if hit:
+                match = _CODE_RE.search(title)
 
-            if not match:
-                continue
+                if match and match.group() == area_code:
+                    date_str = entry.findtext(f'{{{ATOM_NAMESPACE}}}updated', '')
+                    break
 
-            code = match.group('code')
-
-            if code != area_code:
-                continue
-
-            date_str = entry.get('updated', '')
-            break
+        entry.clear()
 
     if not date_str:
         return None
@@ -200,13 +272,13 @@ async def _get_feed_url(metadata_id: UUID, format_name: str) -> str | None:
     return feed_url
 
 
-async def _fetch_feed(url: str) -> str:
+async def _fetch_feed(url: str) -> bytes:
     try:
-        async with AsyncClient(follow_redirects=True) as client:
-            response = await client.get(url)
-            response.raise_for_status()
+        client = _get_client()
+        response = await client.get(url, follow_redirects=True)
+        response.raise_for_status()
 
-            return response.text
+        return response.content
     except Exception as err:
         raise Exception(f'Error fetching feed: {err}')
 
@@ -215,14 +287,273 @@ async def _fetch_dataset_metadata(metadata_id: UUID) -> Dict[str, Any]:
     url = f'{METADATA_API_URL}/{metadata_id}'
 
     try:
-        async with AsyncClient() as client:
-            response = await client.get(url)
-            response.raise_for_status()
+        client = _get_client()
+        response = await client.get(url)
+        response.raise_for_status()
 
-            return response.json()
+        return response.json()
     except Exception as err:
         raise Exception(f'Error fetching dataset metadata: {err}')
 
 
-__all__ = ['place_order', 'download_file', 'extract_archive',
-           'get_resource_path', 'get_dataset_update_date', 'fetch_order']
+def _get_client() -> AsyncClient:
+    global _client
+
+    if _client is None or _client.is_closed:
+        _client = AsyncClient(limits=Limits(
+            max_connections=HTTP_MAX_CONNECTIONS, keepalive_expiry=300))
+
+    return _client
+
+
+async def _stream_extract(url: str, out_dir: str) -> str:
+    auth = BasicAuth(get_env('API_USERNAME'), get_env('API_PASSWORD'))
+    start = time.time()
+
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[bytes | None] = asyncio.Queue(EXTRACT_QUEUE_SIZE)
+    extraction = loop.run_in_executor(
+        None, _extract_stream, _iter_queue(queue, loop), out_dir)
+
+    try:
+        client = _get_client()
+
+        async with client.stream('GET', url, auth=auth, follow_redirects=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+
+            content_length = response.headers.get('Content-Length')
+            file_size = get_file_size(content_length)
+
+            print(f'Downloading and extracting archive ({file_size:.2f} MB)...')
+
+            async for chunk in response.aiter_bytes(1024 * 1024):
+                if not await _put_chunk(queue, chunk, extraction):
+                    break
+
+        await _put_chunk(queue, None, extraction)
+        await extraction
+
+        print(
+            f'Archive downloaded from "{url}" and extracted in {round(time.time() - start, 2)} sec.')
+        return out_dir
+    except NotStreamUnzippable:
+        raise
+    except Exception as err:
+        raise Exception(f'Error downloading and extracting archive: {err!r}')
+    finally:
+        if not extraction.done():
+            _close_queue(queue)
+            await asyncio.wait([extraction])
+            extraction.exception()
+
+
+async def _put_chunk(queue: asyncio.Queue[bytes | None], chunk: bytes | None, extraction: asyncio.Future[None]) -> bool:
+    put = asyncio.ensure_future(queue.put(chunk))
+    await asyncio.wait([put, extraction], return_when=asyncio.FIRST_COMPLETED)
+
+    if put.done():
+        return True
+
+    put.cancel()
+    extraction.result()
+
+    return False
+
+
+def _close_queue(queue: asyncio.Queue[bytes | None]) -> None:
+    while not queue.empty():
+        queue.get_nowait()
+
+    queue.put_nowait(None)
+
+
+def _iter_queue(queue: asyncio.Queue[bytes | None], loop: asyncio.AbstractEventLoop) -> Iterator[bytes]:
+    while True:
+        chunk = asyncio.run_coroutine_threadsafe(queue.get(), loop).result()
+
+        if chunk is None:
+            return
+
+        yield chunk
+
+
+def _extract_stream(chunks: Iterable[bytes], out_dir: str) -> None:
+    for file_name, _, unzipped_chunks in stream_unzip(chunks, chunk_size=COPY_BUFFER_SIZE):
+        member_name = _decode_member_name(file_name)
+        target_path = _get_target_path(out_dir, member_name)
+
+        if member_name.endswith('/'):
+            target_path.mkdir(parents=True, exist_ok=True)
+
+            for _ in unzipped_chunks:
+                pass
+
+            continue
+
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        _write_file(target_path, unzipped_chunks)
+
+
+def _decode_member_name(file_name: bytes) -> str:
+    try:
+        return file_name.decode('utf-8')
+    except UnicodeDecodeError:
+        return file_name.decode('cp437')
+
+
+def _extract_members_threaded(file_path: str, infos: List[zipfile.ZipInfo], out_dir: str, verify_crc: bool, workers: int) -> None:
+    # zlib and libdeflate release the GIL while decompressing. Each thread gets its own handle for raw reads
+    local = threading.local()
+    files: List[BinaryIO] = []
+
+    def extract(zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo) -> None:
+        file: BinaryIO | None = getattr(local, 'file', None)
+
+        if file is None:
+            file = open(file_path, 'rb')
+            files.append(file)
+            local.file = file
+
+        _extract_member(zip_ref, file, info, out_dir, verify_crc)
+
+    try:
+        with zipfile.ZipFile(file_path, 'r') as zip_ref, ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(extract, zip_ref, info) for info in infos]
+
+            for future in futures:
+                future.result()
+    finally:
+        for file in files:
+            file.close()
+
+
+def _extract_member(zip_ref: zipfile.ZipFile, file: BinaryIO, info: zipfile.ZipInfo, out_dir: str, verify_crc: bool) -> None:
+    target_path = _get_target_path(out_dir, info.filename)
+
+    if info.is_dir():
+        target_path.mkdir(parents=True, exist_ok=True)
+        return
+
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if _can_use_libdeflate(info):
+        _extract_member_libdeflate(file, info, target_path, verify_crc)
+    else:
+        _copy_member(zip_ref, file, info, target_path, verify_crc)
+
+
+def _can_use_libdeflate(info: zipfile.ZipInfo) -> bool:
+    if deflate is None or info.is_dir() or info.flag_bits & 0x1:
+        return False
+
+    return info.compress_type == zipfile.ZIP_DEFLATED and info.file_size <= LIBDEFLATE_MAX_SIZE
+
+
+def _extract_member_libdeflate(file: BinaryIO, info: zipfile.ZipInfo, target_path: Path, verify_crc: bool) -> None:
+    if deflate is None:
+        raise Exception('libdeflate is not installed')
+
+    _seek_member_data(file, info)
+
+    data = deflate.deflate_decompress(file.read(info.compress_size), info.file_size)
+
+    if verify_crc and deflate.crc32(data) != info.CRC:
+        raise Exception(f'Bad CRC-32 for "{info.filename}"')
+
+    fd = os.open(target_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+    try:
+        _write_all(fd, data)
+    finally:
+        os.close(fd)
+
+
+def _copy_member(zip_ref: zipfile.ZipFile, file: BinaryIO, info: zipfile.ZipInfo, target_path: Path, verify_crc: bool) -> None:
+    if not verify_crc and not info.flag_bits & 0x1 and info.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        _seek_member_data(file, info)
+        _write_file(target_path, _iter_member_data(file, info))
+        return
+
+    with zip_ref.open(info) as source, open(target_path, 'wb', buffering=COPY_BUFFER_SIZE) as target:
+        shutil.copyfileobj(source, target, COPY_BUFFER_SIZE)
+
+
+def _seek_member_data(file: BinaryIO, info: zipfile.ZipInfo) -> None:
+    file.seek(info.header_offset)
+    header = file.read(LOCAL_HEADER_SIZE)
+
+    if header[0:4] != LOCAL_HEADER_SIGNATURE:
+        raise Exception(f'Bad local file header for "{info.filename}"')
+
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    file.seek(name_length + extra_length, os.SEEK_CUR)
+
+
+def _iter_member_data(file: BinaryIO, info: zipfile.ZipInfo) -> Iterator[bytes]:
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if info.compress_type == zipfile.ZIP_DEFLATED else None
+    remaining = info.compress_size
+
+    while remaining > 0:
+        chunk = file.read(min(remaining, COPY_BUFFER_SIZE))
+
+        if not chunk:
+            raise Exception(f'Truncated data for "{info.filename}"')
+
+        remaining -= len(chunk)
+        yield decompressor.decompress(chunk) if decompressor else chunk
+
+    if decompressor:
+        yield decompressor.flush()
+
+
+def _get_target_path(out_dir: str, member_name: str) -> Path:
+    root = os.path.realpath(out_dir)
+    target = os.path.realpath(os.path.join(root, member_name))
+
+    if os.path.commonpath([root, target]) != root:
+        raise Exception(f'Illegal path in archive: "{member_name}"')
+
+    return Path(target)
+
+
+def _write_file(target_path: Path, data: Iterable[bytes]) -> None:
+    fd = os.open(target_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+    try:
+        chunks: List[bytes] = []
+        size = 0
+
+        for chunk in data:
+            chunks.append(chunk)
+            size += len(chunk)
+
+            if size >= DOWNLOAD_WRITE_SIZE:
+                _write_chunks(fd, chunks)
+                chunks = []
+                size = 0
+
+        if chunks:
+            _write_chunks(fd, chunks)
+    finally:
+        os.close(fd)
+
+
+def _write_chunks(fd: int, chunks: List[bytes]) -> None:
+    written = os.writev(fd, chunks)
+
+    if written < sum(len(chunk) for chunk in chunks):
+        _write_all(fd, b''.join(chunks)[written:])
+
+
+def _write_all(fd: int, data: bytes | bytearray) -> None:
+    view = memoryview(data)
+
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+__all__ = ['place_order', 'download_file', 'download_and_extract', 'download_then_extract', 'extract_archive',
+           'get_resource_path', 'close_client', 'get_dataset_update_date', 'fetch_order']
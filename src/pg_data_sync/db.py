@@ -1,27 +1,70 @@
+import asyncio
 import os
 import subprocess
 import time
-from collections import Counter, defaultdict
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
 from datetime import datetime, date
+from functools import partial
 from pathlib import Path
-from typing import List, Dict, Any
-from psycopg import AsyncConnection
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, List, Dict, FrozenSet, Sequence, Set, Tuple, Any
+from psycopg import AsyncConnection, AsyncCursor
+from psycopg.errors import InsufficientPrivilege
 from psycopg.rows import dict_row
 from psycopg.sql import SQL, Composed, Identifier, Literal, Placeholder
+from psycopg_pool import AsyncConnectionPool
+from .models import IndexingConfig
 from .utils import load_config
 
 
+PREPARE_THRESHOLD = 3
+RESTORE_JOBS = max(2, (os.cpu_count() or 4) - 1)
+POOL_MAX_SIZE = 4
+INDEX_WORKERS = min(POOL_MAX_SIZE, os.cpu_count() or 1)
+MAINTENANCE_WORKERS = 4
+
+IndexJob = Callable[[], Awaitable[None]]
+
+_pools: Dict[str, AsyncConnectionPool] = {}
+
+
+@dataclass
+class _IndexLookup:
+    primary: Set[Tuple[str, str]] = field(default_factory=set)
+    geom: Set[Tuple[str, str, str]] = field(default_factory=set)
+    cols: Dict[Tuple[str, str], Set[FrozenSet[str]]] = field(
+        default_factory=lambda: defaultdict(set))
+
+
 async def get_connection(db_name: str) -> AsyncConnection:
-    db_user = os.getenv('PGUSER') or 'postgres'
+    return await AsyncConnection.connect(_get_conninfo(db_name), prepare_threshold=PREPARE_THRESHOLD)
+
+
+async def open_pool(db_name: str, min_size: int = 1, max_size: int = POOL_MAX_SIZE) -> AsyncConnectionPool:
+    pool = _pools.get(db_name)
+
+    if pool:
+        return pool
 
-    return await AsyncConnection.connect(f'dbname={db_name} user={db_user}')
+    pool = AsyncConnectionPool(_get_conninfo(db_name), kwargs={'prepare_threshold': PREPARE_THRESHOLD},
+                               min_size=min_size, max_size=max(min_size, max_size), reset=_reset_connection, open=False)
+    _pools[db_name] = pool
+    await pool.open(wait=True)
+
+    return pool
+
+
+async def close_pools() -> None:
+    for db_name in list(_pools):
+        await _close_pool(db_name)
 
 
 async def create_db(db_name: str) -> None:
     sql = SQL('CREATE DATABASE {0}').format(Identifier(db_name))
 
     try:
-        async with await get_connection('postgres') as conn:
+        async with _connect('postgres') as conn:
             await conn.set_autocommit(True)
 
             async with conn.cursor() as cur:
@@ -37,7 +80,7 @@ async def create_extension(db_name: str, extension: str) -> None:
         Identifier(extension))
 
     try:
-        async with await get_connection(db_name) as conn:
+        async with _connect(db_name) as conn:
             await conn.set_autocommit(True)
 
             async with conn.cursor() as cur:
@@ -52,7 +95,7 @@ async def create_schema(db_name: str, schema: str) -> None:
     sql = SQL('CREATE SCHEMA {0}').format(Identifier(schema))
 
     try:
-        async with await get_connection(db_name) as conn:
+        async with _connect(db_name) as conn:
             await conn.set_autocommit(True)
 
             async with conn.cursor() as cur:
@@ -63,12 +106,33 @@ async def create_schema(db_name: str, schema: str) -> None:
         raise Exception(f'Error creating schema: {err}')
 
 
+async def init_db(db_name: str, extensions: List[str], schema: str | None = None) -> None:
+    statements = [SQL('CREATE EXTENSION IF NOT EXISTS {0}').format(Identifier(extension)) for extension in extensions]
+
+    if schema:
+        statements.append(SQL('CREATE SCHEMA {0}').format(Identifier(schema)))
+
+    try:
+        async with _connect(db_name) as conn:
+            async with conn.pipeline(), conn.cursor() as cur:
+                for statement in statements:
+                    await cur.execute(statement)
+
+        for extension in extensions:
+            print(f'Extension created: {extension}')
+
+        if schema:
+            print(f'Schema created: {schema}')
+    except Exception as err:
+        raise Exception(f'Error initializing database: {err}')
+
+
 async def create_role(role_name: str, db_password: str) -> None:
     sql = SQL("CREATE ROLE {0} WITH LOGIN PASSWORD {1}").format(
         Identifier(role_name), Literal(db_password))
 
     try:
-        async with await get_connection('postgres') as conn:
+        async with _connect('postgres') as conn:
             await conn.set_autocommit(True)
 
             async with conn.cursor() as cur:
@@ -79,7 +143,7 @@ async def create_role(role_name: str, db_password: str) -> None:
         raise Exception(f'Error creating role: {err}')
 
 
-def restore_database(filepath: str, db_name: str) -> None:
+async def restore_database(filepath: str, db_name: str, jobs: int = RESTORE_JOBS) -> None:
     print('Restoring database...')
 
     path = Path(filepath)
@@ -101,6 +165,8 @@ def restore_database(filepath: str, db_name: str) -> None:
             'postgres',
             '-d',
             db_name,
+            '-j',
+            str(jobs),
             filepath
         ]
     else:
@@ -109,15 +175,21 @@ def restore_database(filepath: str, db_name: str) -> None:
     start = time.time()
 
     try:
-        subprocess.run(
-            command, capture_output=True, text=True, check=False)
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+
+        _, stderr = await process.communicate()
+
+        if process.returncode:
+            print(
+                f'{path.name} restored with errors ({Path(command[0]).name} exited with code {process.returncode}):\n{stderr.decode(errors='replace')}')
 
         print(f'Database restored in {round(time.time() - start, 2)} sec.')
     except Exception as err:
         raise Exception(f'Error restoring database: {err}')
 
 
-def filegdb_to_postgis(filepath: str, db_name: str, schema: str) -> None:
+async def filegdb_to_postgis(filepath: str, db_name: str, schema: str) -> None:
     print('Converting FGDB to PostGIS database...')
 
     db_host = os.environ.get('PGHOST')
@@ -146,10 +218,14 @@ def filegdb_to_postgis(filepath: str, db_name: str, schema: str) -> None:
     start = time.time()
 
     try:
-        result = subprocess.run(
-            command, capture_output=True, text=True, check=True)
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
 
-        result.check_returncode()
+        stdout, stderr = await process.communicate()
+
+        if process.returncode:
+            raise subprocess.CalledProcessError(
+                process.returncode, command, stdout, stderr)
 
         print(
             f'FGDB converted to PostGIS database in {round(time.time() - start, 2)} sec.')
@@ -158,24 +234,25 @@ def filegdb_to_postgis(filepath: str, db_name: str, schema: str) -> None:
 
 
 async def close_active_connections(db_name: str) -> None:
-    pids = await get_active_connections(db_name)
-
-    if not pids:
-        return
-
-    statements = [SQL('SELECT pg_terminate_backend({0})').format(
-        pid) for pid in pids]
+    sql = SQL("""
+        SELECT pg_terminate_backend(pid)
+        FROM pg_stat_activity
+        WHERE datname = {0}
+            AND backend_type != 'autovacuum worker'
+            AND pid <> pg_backend_pid()
+    """).format(Placeholder())
 
     count = 0
 
-    async with await get_connection('postgres') as conn:
-        for statement in statements:
-            try:
-                async with conn.cursor() as cur:
-                    await cur.execute(statement)
-                    count += 1
-            except Exception as err:
-                print(f'Error closing active connection: {err}')
+    await _close_pool(db_name)
+
+    try:
+        async with _connect('postgres') as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(sql, (db_name,))
+                count = len([record async for record in cur if record[0]])
+    except Exception as err:
+        print(f'Error closing active connections: {err}')
 
     if count:
         print(f'{count} active connection(s) closed')
@@ -185,8 +262,10 @@ async def rename_db(old_db_name: str, new_db_name: str) -> None:
     sql = SQL('ALTER DATABASE {0} RENAME TO {1}').format(
         Identifier(old_db_name), Identifier(new_db_name))
 
+    await _close_pool(old_db_name)
+
     try:
-        async with await get_connection('postgres') as conn:
+        async with _connect('postgres') as conn:
             await conn.set_autocommit(True)
 
             async with conn.cursor() as cur:
@@ -212,10 +291,10 @@ async def rename_schemas(db_name: str, prefix: str) -> None:
             SQL('ALTER SCHEMA {0} RENAME TO {1}').format(Identifier(name), Identifier(new_name)))
 
     try:
-        async with await get_connection(db_name) as conn:
+        async with _connect(db_name) as conn:
             await conn.set_autocommit(True)
 
-            async with conn.cursor() as cur:
+            async with conn.pipeline(), conn.cursor() as cur:
                 for statement in statements:
                     await cur.execute(statement)
 
@@ -228,8 +307,10 @@ async def delete_db(db_name: str) -> None:
     sql = SQL('DROP DATABASE IF EXISTS {0} WITH (FORCE)').format(
         Identifier(db_name))
 
+    await _close_pool(db_name)
+
     try:
-        async with await get_connection('postgres') as conn:
+        async with _connect('postgres') as conn:
             await conn.set_autocommit(True)
 
             async with conn.cursor() as cur:
@@ -245,7 +326,7 @@ async def delete_role(role_name: str) -> None:
         Identifier(role_name))
 
     try:
-        async with await get_connection('postgres') as conn:
+        async with _connect('postgres') as conn:
             await conn.set_autocommit(True)
 
             async with conn.cursor() as cur:
@@ -265,7 +346,7 @@ async def get_creation_date_from_comment(db_name: str) -> date | None:
     """).format(Literal(db_name))
 
     try:
-        async with await get_connection('postgres') as conn:
+        async with _connect('postgres') as conn:
             async with conn.cursor() as cur:
                 await cur.execute(sql)
                 result = await cur.fetchone()
@@ -273,17 +354,7 @@ async def get_creation_date_from_comment(db_name: str) -> date | None:
                 if not result:
                     return None
 
-                comment: str = result[0]
-                splitted = comment.split(':')[1:]
-                date_str = splitted[0].strip() if splitted else None
-
-                if not date_str:
-                    return None
-
-                try:
-                    return datetime.strptime(date_str, '%Y-%m-%d').date()
-                except:
-                    return None
+                return _parse_creation_date_comment(result[0])
     except Exception as err:
         raise Exception(f'Error getting database comment: {err}')
 
@@ -296,7 +367,7 @@ async def set_creation_date_comment(db_name: str) -> None:
         Identifier(db_name), Literal(comment))
 
     try:
-        async with await get_connection('postgres') as conn:
+        async with _connect('postgres') as conn:
             async with conn.cursor() as cur:
                 await cur.execute(sql)
 
@@ -313,7 +384,7 @@ async def get_db_creation_date(db_name: str) -> date | None:
     """).format(Literal(db_name))
 
     try:
-        async with await get_connection('postgres') as conn:
+        async with _connect('postgres') as conn:
             async with conn.cursor() as cur:
                 await cur.execute(sql)
                 result = await cur.fetchone()
@@ -328,12 +399,49 @@ async def get_db_creation_date(db_name: str) -> date | None:
         return None
 
 
+async def get_db_status(db_name: str) -> Tuple[bool, date | None]:
+    statuses = await get_db_statuses([db_name])
+
+    return statuses[db_name]
+
+
+async def get_db_statuses(db_names: List[str]) -> Dict[str, Tuple[bool, date | None]]:
+    sql = SQL("""
+        SELECT datname, {0}, shobj_description(oid, 'pg_database')
+        FROM pg_database
+        WHERE datname = ANY({1})
+    """)
+
+    mod_date_sql = SQL("(pg_stat_file('base/'||oid||'/PG_VERSION', true)).modification")
+    statuses: Dict[str, Tuple[bool, date | None]] = {
+        db_name: (False, None) for db_name in db_names}
+
+    try:
+        async with _connect('postgres') as conn:
+            async with conn.cursor() as cur:
+                try:
+                    await cur.execute(sql.format(mod_date_sql, Placeholder()), (db_names,))
+                except InsufficientPrivilege:
+                    await conn.rollback()
+                    await cur.execute(sql.format(SQL('NULL::timestamptz'), Placeholder()), (db_names,))
+
+                async for db_name, mod_date, comment in cur:
+                    if mod_date:
+                        statuses[db_name] = (True, mod_date.date())
+                    else:
+                        statuses[db_name] = (True, _parse_creation_date_comment(comment))
+
+        return statuses
+    except Exception as err:
+        raise Exception(f'Error getting database status: {err}')
+
+
 async def db_exists(db_name: str) -> bool:
     sql = SQL("SELECT 1 FROM pg_database WHERE datname = {0}").format(
         Literal(db_name))
 
     try:
-        async with await get_connection('postgres') as conn:
+        async with _connect('postgres') as conn:
             async with conn.cursor() as cur:
                 await cur.execute(sql)
                 return await cur.fetchone() != None
@@ -352,37 +460,70 @@ async def create_indexes() -> None:
     created = 0
     start = time.time()
 
-    for config in config.indexing:
-        for db_name in config.dbs:
-            indexes = await _get_indexes(db_name, config.schemas)
+    db_names = sorted(
+        {db_name for indexing_config in config.indexing for db_name in indexing_config.dbs})
 
-            for schema_name in config.schemas:
-                geom_columns = await _get_all_geom_columns(db_name, schema_name, config.tables) if config.geom_index else {}
+    for db_name in db_names:
+        configs = [indexing_config for indexing_config in config.indexing if db_name in indexing_config.dbs]
+        created += await create_db_indexes(db_name, configs, concurrently=True)
 
-                for table_name in config.tables:
-                    if not await table_exists(db_name, schema_name, table_name) and not await materialized_view_exists(db_name, schema_name, table_name):
-                        continue
+    print(f'{created} indexes created in {round(time.time() - start, 2)} sec.')
 
-                    if config.id_column and not _has_primary_key(indexes, schema_name, table_name):
-                        await create_primary_key(db_name, schema_name, table_name, config.id_column)
-                        created += 1
 
-                    if geom_columns:
-                        geom_column_names = geom_columns.get(table_name, [])
+async def create_db_indexes(db_name: str, configs: List[IndexingConfig], concurrently: bool = False) -> int:
+    if not configs:
+        return 0
 
-                        for column_name in geom_column_names:
-                            if not _has_geom_index(indexes, schema_name, table_name, column_name):
-                                await create_geom_index(db_name, schema_name, table_name, column_name)
-                                created += 1
+    all_schemas = sorted({schema_name for indexing_config in configs for schema_name in indexing_config.schemas})
+    indexes = _build_index_lookup(await _get_indexes(db_name, all_schemas))
+    primary_keys: Dict[Tuple[str, str], IndexJob] = {}
+    index_jobs: Dict[Tuple[str, str], List[IndexJob]] = defaultdict(list)
 
-                    col_indexes = config.indexes or []
+    for indexing_config in configs:
+        for schema_name in indexing_config.schemas:
+            geom_columns = await _get_all_geom_columns(db_name, schema_name, indexing_config.tables) if indexing_config.geom_index else {}
 
-                    for column_names in col_indexes:
-                        if not _has_index(indexes, schema_name, table_name, column_names):
-                            await create_index(db_name, schema_name, table_name, column_names)
-                            created += 1
+            for table_name in indexing_config.tables:
+                if not await table_exists(db_name, schema_name, table_name) and not await materialized_view_exists(db_name, schema_name, table_name):
+                    continue
 
-    print(f'{created} indexes created in {round(time.time() - start, 2)} sec.')
+                table_key = (schema_name, table_name)
+
+                if indexing_config.id_column and table_key not in indexes.primary:
+                    primary_keys[table_key] = partial(
+                        create_primary_key, db_name, schema_name, table_name, indexing_config.id_column)
+                    indexes.primary.add(table_key)
+                    indexes.cols[table_key].add(frozenset([indexing_config.id_column]))
+
+                if geom_columns:
+                    geom_column_names = geom_columns.get(table_name, [])
+
+                    for column_name in geom_column_names:
+                        if (schema_name, table_name, column_name) not in indexes.geom:
+                            index_jobs[table_key].append(partial(
+                                create_geom_index, db_name, schema_name, table_name, column_name, concurrently))
+                            indexes.geom.add((schema_name, table_name, column_name))
+                            indexes.cols[table_key].add(frozenset([column_name]))
+
+                col_indexes = indexing_config.indexes or []
+
+                for column_names in col_indexes:
+                    if frozenset(column_names) not in indexes.cols[table_key]:
+                        index_jobs[table_key].append(partial(
+                            create_index, db_name, schema_name, table_name, column_names, concurrently))
+                        indexes.cols[table_key].add(frozenset(column_names))
+
+    semaphore = asyncio.Semaphore(INDEX_WORKERS)
+
+    results = await asyncio.gather(*(_run_index_jobs(semaphore, primary_keys.get(table_key), index_jobs.get(table_key, []), concurrently)
+                                     for table_key in primary_keys.keys() | index_jobs.keys()), return_exceptions=True)
+
+    errors = [result for result in results if isinstance(result, BaseException)]
+
+    if errors:
+        raise errors[0]
+
+    return sum(result for result in results if isinstance(result, int))
 
 
 async def table_exists(db_name: str, schema_name: str, table_name: str) -> bool:
@@ -391,12 +532,12 @@ async def table_exists(db_name: str, schema_name: str, table_name: str) -> bool:
         FROM pg_tables
         WHERE schemaname = {0} 
             AND tablename = {1}
-    """).format(Literal(schema_name), Literal(table_name))
+    """).format(Placeholder(), Placeholder())
 
     try:
-        async with await get_connection(db_name) as conn:
+        async with _connect(db_name) as conn:
             async with conn.cursor() as cur:
-                await cur.execute(sql)
+                await cur.execute(sql, [schema_name, table_name])
                 return await cur.fetchone() != None
     except Exception as err:
         raise Exception(f'Error checking table existence: {err}')
@@ -411,7 +552,7 @@ async def view_exists(db_name: str, schema_name: str, view_name: str) -> bool:
     """).format(Literal(schema_name), Literal(view_name))
 
     try:
-        async with await get_connection(db_name) as conn:
+        async with _connect(db_name) as conn:
             async with conn.cursor() as cur:
                 await cur.execute(sql)
                 return await cur.fetchone() != None
@@ -425,12 +566,12 @@ async def materialized_view_exists(db_name: str, schema_name: str, view_name: st
         FROM pg_matviews
         WHERE schemaname = {0} 
             AND matviewname = {1}
-    """).format(Literal(schema_name), Literal(view_name))
+    """).format(Placeholder(), Placeholder())
 
     try:
-        async with await get_connection(db_name) as conn:
+        async with _connect(db_name) as conn:
             async with conn.cursor() as cur:
-                await cur.execute(sql)
+                await cur.execute(sql, [schema_name, view_name])
                 return await cur.fetchone() != None
     except Exception as err:
         raise Exception(f'Error checking materialized view existence: {err}')
@@ -444,7 +585,7 @@ async def role_exists(role_name: str) -> bool:
     """).format(Literal(role_name))
 
     try:
-        async with await get_connection('postgres') as conn:
+        async with _connect('postgres') as conn:
             async with conn.cursor() as cur:
                 await cur.execute(sql)
                 return await cur.fetchone() != None
@@ -457,7 +598,7 @@ async def get_active_connections(db_name: str) -> List[int]:
         Literal(db_name))
 
     try:
-        async with await get_connection('postgres') as conn:
+        async with _connect('postgres') as conn:
             async with conn.cursor() as cur:
                 await cur.execute(sql)
                 return [record[0] async for record in cur]
@@ -470,7 +611,7 @@ async def get_schema_names(db_name: str, prefix: str) -> List[str]:
         Literal(prefix + '%'))
 
     try:
-        async with await get_connection(db_name) as conn:
+        async with _connect(db_name) as conn:
             async with conn.cursor() as cur:
                 await cur.execute(sql)
                 return [record[0] async for record in cur]
@@ -479,28 +620,11 @@ async def get_schema_names(db_name: str, prefix: str) -> List[str]:
 
 
 async def create_primary_key(db_name: str, schema_name: str, table_name: str, column_name: str) -> None:
-    sql1 = SQL("""
-        ALTER TABLE {0}.{1}
-        ALTER COLUMN {2}
-        SET NOT NULL
-    """).format(
-        Identifier(schema_name),
-        Identifier(table_name),
-        Identifier(column_name)
-    )
-
-    sql2 = SQL("""
-        ALTER TABLE {0}.{1}
-        ALTER COLUMN {2} ADD GENERATED BY DEFAULT AS IDENTITY
-    """).format(
-        Identifier(schema_name),
-        Identifier(table_name),
-        Identifier(column_name)
-    )
-
-    sql3 = SQL("""
+    sql = SQL("""
         ALTER TABLE {0}.{1}
-        ADD PRIMARY KEY ({2})
+            ALTER COLUMN {2} SET NOT NULL,
+            ALTER COLUMN {2} ADD GENERATED BY DEFAULT AS IDENTITY,
+            ADD PRIMARY KEY ({2})
     """).format(
         Identifier(schema_name),
         Identifier(table_name),
@@ -508,24 +632,21 @@ async def create_primary_key(db_name: str, schema_name: str, table_name: str, co
     )
 
     try:
-        async with await get_connection(db_name) as conn:
-            await conn.set_autocommit(False)
+        async with _connect(db_name) as conn:
+            await conn.set_autocommit(True)
 
             async with conn.cursor() as cur:
-                await cur.execute(sql1)
-                await cur.execute(sql2)
-                await cur.execute(sql3)
-
-            await conn.commit()
+                await cur.execute(sql)
     except Exception as err:
         raise Exception(
             f'Error creating primary key on column {column_name} in table {schema_name}.{table_name}', err)
 
 
-async def create_index(db_name: str, schema_name: str, table_name: str, column_names: List[str]) -> None:
+async def create_index(db_name: str, schema_name: str, table_name: str, column_names: List[str], concurrently: bool = False) -> None:
     index_name = f'{table_name}_{"_".join(column_names)}_idx'
 
-    sql = SQL('CREATE INDEX {0} ON {1}.{2} ({3})').format(
+    sql = SQL('CREATE INDEX {0} {1} ON {2}.{3} ({4})').format(
+        SQL('CONCURRENTLY') if concurrently else SQL(''),
         Identifier(index_name),
         Identifier(schema_name),
         Identifier(table_name),
@@ -533,18 +654,17 @@ async def create_index(db_name: str, schema_name: str, table_name: str, column_n
     )
 
     try:
-        async with await get_connection(db_name) as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(sql)
+        await _build_index(db_name, schema_name, index_name, sql, concurrently)
     except Exception as err:
         raise Exception(
             f'Error creating index on column(s) {", ".join(column_names)} in table {schema_name}.{table_name}', err)
 
 
-async def create_geom_index(db_name: str, schema_name: str, table_name: str, column_name: str) -> None:
+async def create_geom_index(db_name: str, schema_name: str, table_name: str, column_name: str, concurrently: bool = False) -> None:
     index_name = f'{table_name}_{column_name}_geom_idx'
 
-    sql = SQL('CREATE INDEX {0} ON {1}.{2} USING GIST ({3})').format(
+    sql = SQL('CREATE INDEX {0} {1} ON {2}.{3} USING GIST ({4})').format(
+        SQL('CONCURRENTLY') if concurrently else SQL(''),
         Identifier(index_name),
         Identifier(schema_name),
         Identifier(table_name),
@@ -552,14 +672,37 @@ async def create_geom_index(db_name: str, schema_name: str, table_name: str, col
     )
 
     try:
-        async with await get_connection(db_name) as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(sql)
+        await _build_index(db_name, schema_name, index_name, sql, concurrently)
     except Exception as err:
         raise Exception(
             f'Error creating geometry index on column {column_name} in table {schema_name}.{table_name}', err)
 
 
+async def copy_rows(db_name: str, schema_name: str, table_name: str, columns: List[str], types: List[str], rows: AsyncIterable[Sequence[Any]]) -> int:
+    sql = SQL('COPY {0}.{1} ({2}) FROM STDIN WITH (FORMAT BINARY)').format(
+        Identifier(schema_name),
+        Identifier(table_name),
+        SQL(', ').join(Identifier(column) for column in columns)
+    )
+
+    count = 0
+
+    try:
+        async with _connect(db_name) as conn:
+            async with conn.cursor() as cur:
+                async with cur.copy(sql) as copy:
+                    copy.set_types(types)
+
+                    async for row in rows:
+                        await copy.write_row(row)
+                        count += 1
+
+        return count
+    except Exception as err:
+        raise Exception(
+            f'Error copying rows to table {schema_name}.{table_name}: {err}')
+
+
 async def get_columns(db_name: str, schema_name: str, table_name: str) -> List[str]:
     sql = SQL("""
         SELECT column_name
@@ -570,7 +713,7 @@ async def get_columns(db_name: str, schema_name: str, table_name: str) -> List[s
     """).format(Literal(schema_name), Literal(table_name))
 
     try:
-        async with await get_connection(db_name) as conn:
+        async with _connect(db_name) as conn:
             async with conn.cursor() as cur:
                 await cur.execute(sql)
                 return [record[0] async for record in cur]
@@ -594,7 +737,7 @@ async def get_mv_columns(db_name: str, schema_name: str, mv_name: str) -> List[s
     """).format(Literal(schema_name), Literal(mv_name))
 
     try:
-        async with await get_connection(db_name) as conn:
+        async with _connect(db_name) as conn:
             async with conn.cursor() as cur:
                 await cur.execute(sql)
                 return [record[0] async for record in cur]
@@ -612,7 +755,7 @@ async def get_geom_columns(db_name, schema_name, table_name) -> List[str]:
     """).format(Literal(schema_name), Literal(table_name))
 
     try:
-        async with await get_connection(db_name) as conn:
+        async with _connect(db_name) as conn:
             async with conn.cursor() as cur:
                 await cur.execute(sql)
                 return [record[0] async for record in cur]
@@ -625,15 +768,13 @@ async def _get_all_geom_columns(db_name: str, schema_name: str, table_names: Lis
     sql = SQL("""
         SELECT f_table_name, f_geometry_column
         FROM geometry_columns 
-        WHERE f_table_schema = {0} AND f_table_name IN ({1})
-    """).format(
-        Literal(schema_name), SQL(', ').join(Placeholder() * len(table_names))
-    )
+        WHERE f_table_schema = {0} AND f_table_name = ANY({1})
+    """).format(Placeholder(), Placeholder())
 
     try:
-        async with await get_connection(db_name) as conn:
+        async with _connect(db_name) as conn:
             async with conn.cursor() as cur:
-                await cur.execute(sql, table_names)
+                await cur.execute(sql, [schema_name, table_names])
                 result = [record async for record in cur]
                 grouped = defaultdict(list)
 
@@ -668,7 +809,7 @@ async def _get_indexes(db_name: str, schema_names: List[str]) -> List[Dict[str,
           LEFT JOIN pg_attribute a ON a.attrelid = t.oid
           AND a.attnum = x.attnum
         WHERE
-          t.relkind = 'r'
+          t.relkind IN ('r', 'm')
           AND n.nspname IN ({0})
         GROUP BY
           n.nspname,
@@ -684,30 +825,135 @@ async def _get_indexes(db_name: str, schema_names: List[str]) -> List[Dict[str,
         SQL(', ').join(Placeholder() * len(schema_names))
     )
 
-    async with await get_connection(db_name) as conn:
+    async with _connect(db_name) as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
             await cur.execute(sql, schema_names)
             return [record async for record in cur]
 
 
-def _has_primary_key(indexes: List[Dict[str, Any]], schema_name: str, table_name: str) -> bool:
-    return any(index['schema_name'] == schema_name and index['table_name'] ==
-               table_name and index['is_primary'] == True for index in indexes)
+def _get_conninfo(db_name: str) -> str:
+    db_user = os.getenv('PGUSER') or 'postgres'
+
+    return f'dbname={db_name} user={db_user}'
+
+
+@asynccontextmanager
+async def _connect(db_name: str) -> AsyncIterator[AsyncConnection]:
+    pool = _pools.get(db_name) or await open_pool(db_name)
+
+    async with pool.connection() as conn:
+        yield conn
+
+
+async def _reset_connection(conn: AsyncConnection) -> None:
+    await conn.set_autocommit(False)
+
+
+async def _close_pool(db_name: str) -> None:
+    pool = _pools.pop(db_name, None)
+
+    if pool:
+        await pool.close()
+
+
+async def _build_index(db_name: str, schema_name: str, index_name: str, sql: Composed, concurrently: bool) -> None:
+    workers_sql = SQL('SET {0} max_parallel_maintenance_workers = {1}').format(
+        SQL('SESSION') if concurrently else SQL('LOCAL'), Literal(MAINTENANCE_WORKERS))
+
+    async with _connect(db_name) as conn:
+        if not concurrently:
+            async with conn.cursor() as cur:
+                await cur.execute(workers_sql)
+                await cur.execute(sql)
+
+            return
+
+        await conn.set_autocommit(True)
+
+        async with conn.cursor() as cur:
+            await cur.execute(workers_sql)
+
+            try:
+                await cur.execute(sql)
+            except Exception:
+                if await _is_invalid_index(cur, schema_name, index_name):
+                    await cur.execute(SQL('DROP INDEX CONCURRENTLY IF EXISTS {0}.{1}').format(
+                        Identifier(schema_name), Identifier(index_name)))
+                raise
+            finally:
+                await cur.execute(SQL('RESET max_parallel_maintenance_workers'))
+
+
+async def _is_invalid_index(cur: AsyncCursor, schema_name: str, index_name: str) -> bool:
+    sql = SQL("""
+        SELECT 1
+        FROM pg_index ix
+        JOIN pg_class i ON i.oid = ix.indexrelid
+        JOIN pg_namespace n ON n.oid = i.relnamespace
+        WHERE n.nspname = {0}
+            AND i.relname = {1}::name
+            AND NOT ix.indisvalid
+    """).format(Placeholder(), Placeholder())
+
+    await cur.execute(sql, [schema_name, index_name])
+
+    return await cur.fetchone() != None
+
+
+async def _run_index_jobs(semaphore: asyncio.Semaphore, primary_key: IndexJob | None, jobs: List[IndexJob], concurrently: bool) -> int:
+    if primary_key:
+        async with semaphore:
+            await primary_key()
+
+    async def run(job: IndexJob) -> None:
+        async with semaphore:
+            await job()
+
+    # CONCURRENTLY builds take a self-conflicting SHARE UPDATE EXCLUSIVE lock, so builds on the same table cannot overlap
+    if concurrently:
+        for job in jobs:
+            await run(job)
+    else:
+        await asyncio.gather(*(run(job) for job in jobs))
+
+    return len(jobs) + (1 if primary_key else 0)
+
+
+def _parse_creation_date_comment(comment: str | None) -> date | None:
+    if not comment:
+        return None
+
+    splitted = comment.split(':')[1:]
+    date_str = splitted[0].strip() if splitted else None
+
+    if not date_str:
+        return None
+
+    try:
+        return datetime.strptime(date_str, '%Y-%m-%d').date()
+    except:
+        return None
+
+
+def _build_index_lookup(indexes: List[Dict[str, Any]]) -> _IndexLookup:
+    lookup = _IndexLookup()
+
+    for index in indexes:
+        table_key = (index['schema_name'], index['table_name'])
 
+        if index['is_primary']:
+            lookup.primary.add(table_key)
 
-def _has_geom_index(indexes: List[Dict[str, Any]], schema_name: str, table_name: str, column_name: str) -> bool:
-    return any(index['schema_name'] == schema_name and index['table_name'] ==
-               table_name and index['index_type'] == 'gist' and index['indexed_columns'][0] ==
-               column_name for index in indexes)
+        if index['index_type'] == 'gist':
+            lookup.geom.add((*table_key, index['indexed_columns'][0]))
 
+        lookup.cols[table_key].add(frozenset(index['indexed_columns']))
 
-def _has_index(indexes: List[Dict[str, Any]], schema_name: str, table_name: str, column_names: List[str]) -> bool:
-    return any(index['schema_name'] == schema_name and index['table_name'] ==
-               table_name and Counter(index['indexed_columns']) == Counter(column_names) for index in indexes)
+    return lookup
 
 
-__all__ = ['close_active_connections', 'create_db', 'create_extension', 'create_geom_index', 'create_index', 'create_indexes',
-           'create_primary_key', 'create_role', 'create_schema', 'db_exists', 'delete_db', 'dict_row', 'filegdb_to_postgis',
-           'get_active_connections', 'get_columns', 'get_connection', 'get_db_creation_date', 'get_geom_columns', 'get_schema_names',
+__all__ = ['close_active_connections', 'close_pools', 'create_db', 'create_extension', 'create_geom_index', 'create_index', 'create_indexes', 'create_db_indexes',
+           'copy_rows', 'create_primary_key', 'create_role', 'create_schema', 'db_exists', 'delete_db', 'dict_row', 'filegdb_to_postgis',
+           'get_active_connections', 'get_columns', 'get_connection', 'get_db_creation_date', 'get_db_status', 'get_db_statuses', 'get_geom_columns', 'get_schema_names', 'init_db', 'open_pool',
            'rename_db', 'rename_schemas', 'restore_database', 'role_exists', 'get_creation_date_from_comment', 'set_creation_date_comment',
            'view_exists']
@@ -1,6 +1,6 @@
 from uuid import UUID
 from typing import List, Dict, Any
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, PositiveInt
 from .file_map import FileMap
 from .enums import AreaType, Format
 
@@ -12,6 +12,9 @@ class DatasetConfig(BaseModel):
     epsg: str
     format: Format
     files: List[FileMap]
+    verify_crc: bool = True
+    stream_extract: bool = True
+    max_parallel: PositiveInt = 4
 
     model_config = ConfigDict(
         coerce_numbers_to_str=True
@@ -1,24 +1,33 @@
+import asyncio
 import time
 import traceback
+from dataclasses import dataclass, field
 from datetime import date
-from uuid import uuid4
-from pathlib import Path
-from typing import List
+from typing import List, Tuple
 from . import dataset, db, utils
 from .models import DatasetConfig, IndexingConfig, FileMap, Format, ExitCode
 
-tmp_dbs_created: List[str] = []
-roles_created: List[str] = []
+
+@dataclass
+class _RunState:
+    tmp_dbs: List[str] = field(default_factory=list)
+    roles: List[str] = field(default_factory=list)
+    roles_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
 
 
 async def start() -> ExitCode:
     download_path: str = ''
+    state = _RunState()
+    utils.load_config.cache_clear()
 
     try:
         start = time.time()
         config = utils.load_config()
-        dataset_updated = await dataset.get_dataset_update_date(config.dataset.metadata_id, config.dataset.area_code, config.dataset.area_type, config.dataset.epsg, config.dataset.format)
-        file_maps = [file_map for file_map in config.dataset.files if await _should_restore_db(file_map.db_name, dataset_updated)]
+        dataset_updated, _ = await asyncio.gather(
+            dataset.get_dataset_update_date(config.dataset.metadata_id, config.dataset.area_code, config.dataset.area_type, config.dataset.epsg, config.dataset.format),
+            db.open_pool('postgres', max_size=max(db.POOL_MAX_SIZE, config.dataset.max_parallel)))
+        db_statuses = await db.get_db_statuses([file_map.db_name for file_map in config.dataset.files])
+        file_maps = [file_map for file_map in config.dataset.files if _should_restore_db(db_statuses[file_map.db_name], dataset_updated)]
 
         if not file_maps:
             print('No need to restore database(s). Aborting...')
@@ -26,21 +35,41 @@ async def start() -> ExitCode:
 
         download_path = await _download_dataset(config.dataset)
 
-        for file_map in file_maps:
-            await _restore_database(download_path, file_map, config.dataset.format, config.indexing)
+        semaphore = asyncio.Semaphore(config.dataset.max_parallel)
+        restore_jobs = max(1, db.RESTORE_JOBS // min(config.dataset.max_parallel, len(file_maps)))
+
+        async def restore(file_map: FileMap) -> None:
+            async with semaphore:
+                await _restore_database(state, download_path, file_map, config.dataset.format, config.indexing, restore_jobs)
+
+        results = await asyncio.gather(*(restore(file_map) for file_map in file_maps), return_exceptions=True)
+        failed = [(file_map.db_name, result) for file_map, result in zip(file_maps, results) if isinstance(result, BaseException)]
 
-        utils.delete_file_or_dir(download_path)
+        for db_name, error in failed:
+            print(f'Error restoring database {db_name}:')
+            print(''.join(traceback.format_exception(error)))
+
+        if failed:
+            raise Exception(
+                f'Error restoring database(s): {", ".join(db_name for db_name, _ in failed)}') from None
+
+        await asyncio.to_thread(utils.delete_file_or_dir, download_path)
 
         print(f'Job finished in {round(time.time() - start, 2)} sec.')
         return ExitCode.SUCCESS
     except Exception:
         err = traceback.format_exc()
         print(err)
-        await _clean_up(download_path)
+        await _clean_up(state, download_path)
         return ExitCode.FAILURE
+    finally:
+        await dataset.close_client()
+        await db.close_pools()
 
 
 async def create_indexes() -> ExitCode:
+    utils.load_config.cache_clear()
+
     try:
         await db.create_indexes()
         return ExitCode.SUCCESS
@@ -48,43 +77,51 @@ async def create_indexes() -> ExitCode:
         err = traceback.format_exc()
         print(err)
         return ExitCode.FAILURE
+    finally:
+        await db.close_pools()
 
 
 async def _download_dataset(config: DatasetConfig) -> str:
     download_url = await dataset.place_order(config)
     download_path = utils.get_download_path()
-    download_filename = str(Path(download_path).joinpath(f'{uuid4()}.zip'))
 
-    await dataset.download_file(download_url, download_filename)
-    dataset.extract_archive(download_filename, download_path)
+    if config.stream_extract:
+        return await dataset.download_and_extract(download_url, download_path, config.verify_crc)
 
-    return download_path
+    return await dataset.download_then_extract(download_url, download_path, config.verify_crc)
 
 
-async def _restore_database(download_path: str, file_map: FileMap, format: Format, indexing_configs: List[IndexingConfig] | None) -> None:
-    resource_path = dataset.get_resource_path(
-        download_path, file_map.glob)
+async def _restore_database(state: _RunState, download_path: str, file_map: FileMap, format: Format, indexing_configs: List[IndexingConfig] | None, restore_jobs: int) -> None:
+    resource_path = await asyncio.to_thread(dataset.get_resource_path, download_path, file_map.glob)
     tmp_db_name = utils.get_tmp_db_name()
 
-    if file_map.db_role and not await db.role_exists(file_map.db_role):
-        await db.create_role(file_map.db_role, file_map.db_role_pwd or utils.get_env('PGPASSWORD'))
-        roles_created.append(file_map.db_role)
+    if file_map.db_role:
+        async with state.roles_lock:
+            if not await db.role_exists(file_map.db_role):
+                await db.create_role(file_map.db_role, file_map.db_role_pwd or utils.get_env('PGPASSWORD'))
+                state.roles.append(file_map.db_role)
 
     await db.create_db(tmp_db_name)
-    tmp_dbs_created.append(tmp_db_name)
+    state.tmp_dbs.append(tmp_db_name)
 
-    await db.create_extension(tmp_db_name, 'postgis')
+    schema = file_map.db_schema or file_map.db_name
+
+    if format == Format.FGDB and schema != 'public':
+        await db.init_db(tmp_db_name, ['postgis'], schema)
+    else:
+        await db.init_db(tmp_db_name, ['postgis'])
 
     if format == Format.FGDB:
-        schema = file_map.db_schema or file_map.db_name
+        await db.filegdb_to_postgis(resource_path, tmp_db_name, schema)
+    else:
+        await db.restore_database(resource_path, tmp_db_name, restore_jobs)
+        await db.rename_schemas(tmp_db_name, schema)
 
-        if schema != 'public':
-            await db.create_schema(tmp_db_name, schema)
+    configs = [indexing_config for indexing_config in indexing_configs or [] if file_map.db_name in indexing_config.dbs]
 
-        db.filegdb_to_postgis(resource_path, tmp_db_name, schema)
-    else:
-        db.restore_database(resource_path, tmp_db_name)
-        await db.rename_schemas(tmp_db_name, file_map.db_schema or file_map.db_name)
+    if configs:
+        created = await db.create_db_indexes(tmp_db_name, configs)
+        print(f'{created} indexes created in {file_map.db_name}')
 
     await db.set_creation_date_comment(tmp_db_name)
 
@@ -97,25 +134,25 @@ async def _restore_database(download_path: str, file_map: FileMap, format: Forma
     await db.rename_db(tmp_db_name, file_map.db_name)
 
 
-async def _should_restore_db(db_name: str, dataset_updated: date | None) -> bool:
-    if not await db.db_exists(db_name):
-        return True
+def _should_restore_db(db_status: Tuple[bool, date | None], dataset_updated: date | None) -> bool:
+    exists, db_created = db_status
 
-    db_created = await db.get_db_creation_date(db_name) or await db.get_creation_date_from_comment(db_name)
+    if not exists:
+        return True
 
     return dataset_updated >= db_created if db_created and dataset_updated else True
 
 
-async def _clean_up(download_path: str) -> None:
+async def _clean_up(state: _RunState, download_path: str) -> None:
     print('Cleaning up...')
 
     if download_path:
-        utils.delete_file_or_dir(download_path)
+        await asyncio.to_thread(utils.delete_file_or_dir, download_path)
 
-    for db_name in tmp_dbs_created:
+    for db_name in state.tmp_dbs:
         await db.delete_db(db_name)
 
-    for role_name in roles_created:
+    for role_name in state.roles:
         await db.delete_role(role_name)
 
 
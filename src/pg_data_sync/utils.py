@@ -1,12 +1,22 @@
+import itertools
 import os
+import time
 import yaml
 import shutil
-from datetime import datetime
-from uuid import uuid4
-from typing import Dict
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List
 from pathlib import Path
 from .models import Config
 
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+RMTREE_WORKERS = 8
+RMTREE_MIN_ENTRIES = 256
+RMTREE_BATCH_SIZE = 64
+
+_counter = itertools.count()
+
 
 def get_env(key: str) -> str:
     if key in os.environ:
@@ -19,46 +29,43 @@ def get_config_dir() -> str:
     return get_env('CONFIG_DIR')
 
 
+@lru_cache(maxsize=1)
 def load_config() -> Config:
-    file_path = Path(get_config_dir()).joinpath('config.yml')
+    file_path = _config_dir() / 'config.yml'
 
     if not file_path.exists():
         raise Exception(f'Configuration file "{file_path}" not found')
 
     with open(file_path) as file:
-        result: Dict = yaml.safe_load(file)
+        result: Dict = yaml.load(file, Loader=YAML_LOADER)
 
     return Config(**result)
 
 
 def get_download_path() -> str:
     download_dir = os.environ.get('DOWNLOAD_DIR')
-    uuid = str(uuid4())
 
-    return str(Path(download_dir or get_config_dir()).joinpath(uuid))
+    base_dir = Path(download_dir) if download_dir else _config_dir()
 
+    return str(base_dir / _get_unique_id())
 
-def get_tmp_db_name() -> str:
-    id = str(uuid4()).replace('-', '')
 
-    return f'tmp_{id}'
+def get_tmp_db_name() -> str:
+    return f'tmp_{_get_unique_id()}'
 
 
 def get_backup_db_name(db_name: str) -> str:
-    return f'{db_name}_bak_{datetime.now().strftime('%Y%m%d%H%M%S')}'
+    return f'{db_name}_bak_{time.strftime('%Y%m%d%H%M%S')}'
 
 
 def delete_file_or_dir(path: str) -> None:
-    path_obj = Path(path)
-
-    if not path_obj.exists():
-        return
-
     try:
-        if path_obj.is_dir():
-            shutil.rmtree(path)
+        if stat.S_ISDIR(os.lstat(path).st_mode):
+            _rmtree(path)
         else:
-            path_obj.unlink()
+            os.unlink(path)
+    except FileNotFoundError:
+        return
     except Exception as err:
         raise Exception(f'Error deleting "{path}": {err}')
 
@@ -70,5 +77,49 @@ def get_file_size(content_length: str | None) -> float:
     return int(content_length) / (1024 * 1024)
 
 
+def _rmtree(path: str) -> None:
+    files: List[str] = []
+    dirs: List[str] = []
+    _scan_tree(path, files, dirs)
+
+    if len(files) + len(dirs) < RMTREE_MIN_ENTRIES:
+        shutil.rmtree(path)
+        return
+
+    batches = [files[i:i + RMTREE_BATCH_SIZE] for i in range(0, len(files), RMTREE_BATCH_SIZE)]
+
+    with ThreadPoolExecutor(max_workers=RMTREE_WORKERS) as executor:
+        for _ in executor.map(_unlink_all, batches):
+            pass
+
+    for dir_path in reversed(dirs):
+        os.rmdir(dir_path)
+
+
+def _scan_tree(path: str, files: List[str], dirs: List[str]) -> None:
+    dirs.append(path)
+
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                _scan_tree(entry.path, files, dirs)
+            else:
+                files.append(entry.path)
+
+
+def _unlink_all(paths: List[str]) -> None:
+    for path in paths:
+        os.unlink(path)
+
+
+@lru_cache(maxsize=1)
+def _config_dir() -> Path:
+    return Path(get_config_dir())
+
+
+def _get_unique_id() -> str:
+    return f'{os.getpid()}_{int(time.time() * 1000):x}_{next(_counter):x}'
+
+
 __all__ = ['get_env', 'load_config', 'get_download_path', 'get_tmp_db_name',
            'get_backup_db_name', 'delete_file_or_dir', 'get_file_size']